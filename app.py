@@ -1,29 +1,81 @@
-from flask import Flask, request, jsonify, send_from_directory, Response
-import datetime, json, os, csv, io, ipaddress, urllib.request, urllib.error
+from flask import Flask, request, send_from_directory, Response, stream_with_context
+import datetime, os, ipaddress
+import atexit, gzip, hashlib, sqlite3, threading, time, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+import maxminddb
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_FILE = os.path.join(APP_DIR, "ip_log.txt")
 GEO_CACHE_FILE = os.path.join(APP_DIR, "geo_cache.json")
+# APP_DIR 是 Flask 的 static_folder，快取資料庫不能放在裡面（會被直接下載）；可用 GEO_CACHE_DB_PATH 指定位置
+GEO_CACHE_DB = os.environ.get("GEO_CACHE_DB_PATH") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "attack-simulator", "geo.db")
+SIMULATOR_PATH = os.path.join(APP_DIR, "attack_simulator_integrated_full.html")
+SIMULATOR_EXISTS = os.path.isfile(SIMULATOR_PATH)  # 檔案配置執行中不會變，啟動時判斷一次即可
+LOCAL_TZ = datetime.datetime.now().astimezone().tzinfo  # 啟動時取一次，避免每筆記錄重算時區
+LOG_FLUSH_MS = int(os.environ.get("LOG_FLUSH_MS", "200"))  # 記錄檔最長多久 flush 一次
+# 設為 1 時不記錄內網/本機來源（本機開發、健康檢查）
+LOG_EXCLUDE_PRIVATE = os.environ.get("LOG_EXCLUDE_PRIVATE") == "1"
 
 app = Flask(__name__, static_folder=".")
 
 # --- GeoIP cache ---
-if os.path.exists(GEO_CACHE_FILE):
+# 持久層用 SQLite（WAL）：逐筆寫入、多個 gunicorn worker 共用也安全；GEO_CACHE 只當本行程的記憶體快取。
+# 資料庫建不起來（目錄無法建立、沒有寫入權限…）時 GEO_CONN = None，只用記憶體快取
+try:
+    os.makedirs(os.path.dirname(GEO_CACHE_DB), exist_ok=True)
+    GEO_CONN = sqlite3.connect(GEO_CACHE_DB, check_same_thread=False, isolation_level=None)
+    GEO_CONN.execute("PRAGMA journal_mode=WAL")
+    GEO_CONN.execute("CREATE TABLE IF NOT EXISTS geo("
+                     "ip TEXT PRIMARY KEY, country TEXT, city TEXT, org TEXT, ts INTEGER, ok INTEGER)")
+except (OSError, sqlite3.Error):
+    GEO_CONN = None
+GEO_CONN_LOCK = threading.Lock()
+GEO_CACHE = {}  # { ip: {"country":"", "city":"", "org":"", "ts": epoch 秒, "ok": bool} }
+
+def save_geo_entries(entries: dict):
+    """把 {ip: entry} 寫進 SQLite；多筆時包在同一個交易裡。"""
+    if GEO_CONN is None:
+        return
+    rows = [(ip, e.get("country", ""), e.get("city", ""), e.get("org", ""),
+             int(e.get("ts", 0) or 0), 1 if e.get("ok", True) else 0) for ip, e in entries.items()]
     try:
-        with open(GEO_CACHE_FILE, "r", encoding="utf-8") as f:
-            GEO_CACHE = json.load(f)
+        with GEO_CONN_LOCK, GEO_CONN:  # 離開 with 時 COMMIT，出錯則 ROLLBACK
+            GEO_CONN.execute("BEGIN")
+            GEO_CONN.executemany("INSERT OR REPLACE INTO geo(ip, country, city, org, ts, ok) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)", rows)
     except Exception:
-        GEO_CACHE = {}
-else:
-    GEO_CACHE = {}  # { ip: {"country":"", "city":"", "org":"", "ts":"..."} }
+        pass
 
-def save_geo_cache():
+def load_geo_entry(ip: str):
+    if GEO_CONN is None:
+        return None
     try:
-        with open(GEO_CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(GEO_CACHE, f, ensure_ascii=False)
+        with GEO_CONN_LOCK:
+            row = GEO_CONN.execute("SELECT country, city, org, ts, ok FROM geo WHERE ip = ?", (ip,)).fetchone()
     except Exception:
-        pass
+        return None
+    if row is None:
+        return None
+    return {"country": row[0] or "", "city": row[1] or "", "org": row[2] or "", "ts": row[3] or 0, "ok": bool(row[4])}
 
+# 舊版的 geo_cache.json 一次匯入後就不再使用
+try:
+    if (GEO_CONN is not None and os.path.exists(GEO_CACHE_FILE)
+            and GEO_CONN.execute("SELECT 1 FROM geo LIMIT 1").fetchone() is None):
+        with open(GEO_CACHE_FILE, "rb") as f:
+            save_geo_entries(orjson.loads(f.read()))
+except Exception:
+    pass
+
+@lru_cache(maxsize=8192)  # /logs_with_geo.json 每輪都要判斷同一批 IP
 def is_private(ip: str) -> bool:
     try:
         return ipaddress.ip_address(ip).is_private
@@ -32,14 +84,143 @@ def is_private(ip: str) -> bool:
 
 def client_ip(req):
     # 優先取 X-Forwarded-For 第一個 IP（前面有 CDN/反代時）
-    xff = req.headers.get("X-Forwarded-For", "")
+    xff = req.headers.get("X-Forwarded-For")
     if xff:
-        return xff.split(",")[0].strip()
+        head, _, _ = xff.partition(",")  # 只切第一段，不必把整串代理鏈拆成 list
+        return head.strip()
     return req.remote_addr or "0.0.0.0"
 
+# --- 訪問記錄：常駐檔案 handle + 背景定時批次寫出 ---
+# 記錄先累積在 _LOG_PENDING，由 flusher 每 LOG_FLUSH_MS 合併成一次 write；
+# 尚未寫出的資料不放在檔案 handle 的緩衝裡，記錄檔被刪除/輪替時改開新檔也不會遺失
+LOG_FH = open(LOG_FILE, "ab", buffering=0)
+LOG_LOCK = threading.Lock()
+_LOG_PENDING = []
+
+def _reopen_log_if_moved():
+    # 呼叫端需持有 LOG_LOCK。記錄檔被刪除或輪替（inode 變了）時改寫到新檔，否則之後的記錄會寫進已刪除的舊檔
+    global LOG_FH, LOG_SIZE
+    if LOG_FH.closed:
+        return
+    try:
+        if os.fstat(LOG_FH.fileno()).st_ino == os.stat(LOG_FILE).st_ino:
+            return
+    except OSError:
+        pass
+    try:
+        fh = open(LOG_FILE, "ab", buffering=0)
+    except OSError:
+        return  # 開不了新檔就先沿用舊的，下次再試
+    LOG_FH.close()
+    LOG_FH = fh
+    # 新檔從目前大小算起（加上待寫出的部分），ring 保留原內容，不因檔案變小而清空
+    LOG_SIZE = os.fstat(fh.fileno()).st_size + sum(map(len, _LOG_PENDING))
+
+def _flush_log():
+    # 呼叫端需持有 LOG_LOCK
+    _reopen_log_if_moved()
+    if _LOG_PENDING and not LOG_FH.closed:
+        LOG_FH.write(b"".join(_LOG_PENDING))
+        _LOG_PENDING.clear()
+
+def _log_flusher():
+    interval = LOG_FLUSH_MS / 1000
+    while True:
+        time.sleep(interval)
+        with LOG_LOCK:
+            _flush_log()
+
+@atexit.register
+def _close_log():
+    with LOG_LOCK:
+        _flush_log()
+        LOG_FH.close()
+
+def tail_jsonl(path: str, n: int, avg_line_len: int = 256) -> list:
+    """只讀檔尾一段並解析最後 n 筆 JSON Lines；筆數不夠就把讀取範圍加倍重試。"""
+    try:
+        size = os.stat(path).st_size
+    except OSError:
+        return []
+    window = avg_line_len * n * 4
+    with open(path, "rb") as f:
+        while True:
+            start = max(0, size - window)
+            f.seek(start)
+            lines = f.read(size - start).splitlines()  # splitlines 已去掉換行，不需再 strip
+            if start > 0:
+                lines = lines[1:]  # 第一行可能只讀到後半段，丟掉
+            items = []
+            for line in reversed(lines):
+                if not line:
+                    continue
+                try:
+                    item = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                if not isinstance(item, dict):
+                    continue  # 合法 JSON 但不是一筆記錄（例如單獨的數字），略過
+                items.append(item)
+                if len(items) >= n:
+                    break
+            if len(items) >= n or start == 0:
+                items.reverse()
+                return items
+            window *= 2
+
+# --- 最近記錄：記憶體內逐欄 ring buffer，/logs.json 與 /logs.csv 直接由此讀取 ---
+# 多個 gunicorn worker 共用同一個記錄檔：檔案大小和本行程寫入的量對不上時，代表別的 worker 也寫了，
+# 這時才從檔尾重新載入 ring；只有單一 worker 時讀取路徑只多一次 flush + stat。
+LOG_FIELDS = ("ts", "ip", "method", "path", "origin", "referer", "ua")
+LOG_RING_SIZE = 5000
+LOG_RING = {k: deque(maxlen=LOG_RING_SIZE) for k in LOG_FIELDS}
+LOG_SEQ = 0   # ring 內容每變一次 +1，供快取判斷是否有新資料
+LOG_SIZE = 0  # 依本行程所知，記錄檔應有的大小（bytes）
+
+def _ring_append(entry: dict):
+    # 呼叫端需持有 LOG_LOCK
+    global LOG_SEQ
+    for k in LOG_FIELDS:
+        LOG_RING[k].append(entry.get(k, ""))
+    LOG_SEQ += 1
+
+def _ring_sync():
+    # 呼叫端需持有 LOG_LOCK
+    global LOG_SEQ, LOG_SIZE
+    _flush_log()
+    try:
+        size = os.stat(LOG_FILE).st_size
+    except OSError:
+        return  # 檔案暫時不在（剛被刪除、還沒重開）：保留 ring，不當成空檔
+    if size == LOG_SIZE:
+        return
+    for k in LOG_FIELDS:
+        LOG_RING[k].clear()
+    for entry in tail_jsonl(LOG_FILE, LOG_RING_SIZE):
+        _ring_append(entry)
+    LOG_SIZE = size
+    LOG_SEQ += 1
+
+def sync_ring() -> int:
+    """必要時從記錄檔補齊 ring，回傳目前的 seq。"""
+    with LOG_LOCK:
+        _ring_sync()
+        return LOG_SEQ
+
+sync_ring()  # 啟動時從既有記錄檔補回最近幾筆
+threading.Thread(target=_log_flusher, name="log-flusher", daemon=True).start()
+
+def ring_columns(n: int):
+    """回傳 (seq, 最近 n 筆的各欄 list)。"""
+    with LOG_LOCK:
+        _ring_sync()
+        start = max(0, len(LOG_RING["ts"]) - n)
+        return LOG_SEQ, [list(islice(LOG_RING[k], start, None)) for k in LOG_FIELDS]
+
 def log_visit(req):
+    global LOG_SIZE
     entry = {
-        "ts": datetime.datetime.now().astimezone().isoformat(),
+        "ts": datetime.datetime.now(LOCAL_TZ).isoformat(timespec="milliseconds"),
         "ip": client_ip(req),
         "method": req.method,
         "path": req.path,
@@ -47,65 +228,246 @@ def log_visit(req):
         "referer": req.headers.get("Referer", ""),
         "ua": req.headers.get("User-Agent", ""),
     }
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    if LOG_EXCLUDE_PRIVATE and is_private(entry["ip"]):
+        return entry
+    line = orjson.dumps(entry) + b"\n"
+    with LOG_LOCK:
+        _LOG_PENDING.append(line)
+        LOG_SIZE += len(line)
+        _ring_append(entry)
     return entry
 
+# /logs.json 快取：ring 沒有新資料就直接回上次編好的 bytes（gzip 版本第一次需要時才壓，存在 "gz"）
+_LOGS_CACHE = {"key": None, "items": [], "body": b"[]", "gz": None}
+_LOGS_CACHE_LOCK = threading.Lock()
+
+def recent_logs(n: int = 500):
+    """回傳 (快取 key, items, 已編碼的 JSON bytes)。"""
+    seq = sync_ring()
+    with _LOGS_CACHE_LOCK:
+        if _LOGS_CACHE["key"] == (seq, n):
+            return _LOGS_CACHE["key"], _LOGS_CACHE["items"], _LOGS_CACHE["body"]
+    seq, cols = ring_columns(n)
+    items = [dict(zip(LOG_FIELDS, row)) for row in zip(*cols)]
+    body = orjson.dumps(items)
+    with _LOGS_CACHE_LOCK:
+        _LOGS_CACHE.update(key=(seq, n), items=items, body=body, gz=None)
+    return (seq, n), items, body
+
+# 本機 MaxMind GeoLite2 資料庫：設了 GEOIP_DB 就整個載入記憶體查詢，不必外連；沒有才退回 ipapi.co。
+# 沒有預設路徑：APP_DIR 是 static_folder，放在裡面會被公開下載（GeoLite2 授權也不允許再散布）
+GEOIP_DB_FILE = os.environ.get("GEOIP_DB", "")
+GEO_DB = None
+if GEOIP_DB_FILE:
+    try:
+        GEO_DB = maxminddb.open_database(GEOIP_DB_FILE, mode=maxminddb.MODE_MEMORY)
+    except (OSError, maxminddb.InvalidDatabaseError):
+        pass
+
+def local_geo(ip: str) -> dict:
+    try:
+        r = GEO_DB.get(ip) or {}
+    except ValueError:
+        r = {}
+    return {
+        "country": (r.get("country") or {}).get("names", {}).get("en", ""),
+        "city": (r.get("city") or {}).get("names", {}).get("en", ""),
+        "org": "",  # City 資料庫沒有 ISP/組織資訊
+        "provider": "maxmind"
+    }
+
+# GeoIP 共用連線池：重用 keep-alive，避免每次查詢都重新 DNS + TLS 握手
+GEO_SESSION = requests.Session()
+GEO_SESSION.headers["User-Agent"] = "ip-logger/1.0"
+# 429 時不要照 Retry-After 在請求執行緒裡睡，交給下方的 cooldown 處理
+GEO_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50,
+                                          max_retries=Retry(total=2, backoff_factor=0.2,
+                                                            respect_retry_after_header=False)))
+
+GEO_NEG_TTL = float(os.environ.get("GEO_NEG_TTL", "600"))      # 查詢失敗的結果快取幾秒
+GEO_COOLDOWN = float(os.environ.get("GEO_COOLDOWN", "60"))     # 被限流（429/403）後暫停外連幾秒
+_GEO_COOLDOWN_UNTIL = 0.0
+
 def fetch_geo_from_provider(ip: str) -> dict:
-    """向免費服務 ipapi.co 查詢 GeoIP。若不想外連，可設環境變數 GEOIP_OFF=1。"""
+    """有本機 GeoLite2 資料庫就直接查；否則向免費服務 ipapi.co 查詢。若不想外連，可設環境變數 GEOIP_OFF=1。"""
+    global _GEO_COOLDOWN_UNTIL
+    if GEO_DB is not None:
+        return local_geo(ip)
     if os.environ.get("GEOIP_OFF") == "1":
         return {"country":"", "city":"", "org":"", "provider":"off"}
+    if time.time() < _GEO_COOLDOWN_UNTIL:
+        return {"country":"", "city":"", "org":"", "provider":"cooldown"}
     url = f"https://ipapi.co/{ip}/json/"
-    req = urllib.request.Request(url, headers={"User-Agent": "ip-logger/1.0"})
     try:
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            data = json.loads(resp.read().decode("utf-8", "ignore"))
-            return {
-                "country": data.get("country_name") or data.get("country") or "",
-                "city": data.get("city") or "",
-                "org": data.get("org") or data.get("asn") or "",
-                "provider": "ipapi.co"
-            }
+        resp = GEO_SESSION.get(url, timeout=5)
+        if resp.status_code in (403, 429):
+            _GEO_COOLDOWN_UNTIL = time.time() + GEO_COOLDOWN
+            return {"country":"", "city":"", "org":"", "provider":"cooldown"}
+        resp.raise_for_status()
+        data = resp.json()
+        if data.get("error"):
+            # ipapi.co 限流時也可能回 200 + {"error": true, "reason": "RateLimited"}
+            if data.get("reason") == "RateLimited":
+                _GEO_COOLDOWN_UNTIL = time.time() + GEO_COOLDOWN
+                return {"country":"", "city":"", "org":"", "provider":"cooldown"}
+            return {"country":"", "city":"", "org":"", "provider":"error"}
+        return {
+            "country": data.get("country_name") or data.get("country") or "",
+            "city": data.get("city") or "",
+            "org": data.get("org") or data.get("asn") or "",
+            "provider": "ipapi.co"
+        }
     except Exception:
         # 失敗就回空，避免阻塞
         return {"country":"", "city":"", "org":"", "provider":"error"}
 
+def geo_cached(ip: str):
+    """回傳仍有效的快取項目；失敗結果（ok=False）只保留 GEO_NEG_TTL 秒。"""
+    cached = GEO_CACHE.get(ip)
+    if cached is None:
+        cached = load_geo_entry(ip)  # 可能已由其他 worker 查過
+        if cached is not None:
+            GEO_CACHE[ip] = cached
+    if cached and (cached.get("ok", True) or time.time() - cached.get("ts", 0) < GEO_NEG_TTL):
+        return cached
+    return None
+
 def geo_lookup(ip: str) -> dict:
     if not ip or is_private(ip) or ip in ("127.0.0.1", "::1"):
         return {"ip": ip, "country": "(private)", "city": "", "org": ""}
-    cached = GEO_CACHE.get(ip)
-    if cached:
-        return {"ip": ip, **cached}
-    info = fetch_geo_from_provider(ip)
-    GEO_CACHE[ip] = {k: info.get(k, "") for k in ("country", "city", "org")}
-    save_geo_cache()
-    return {"ip": ip, **GEO_CACHE[ip]}
+    if GEO_DB is not None:
+        # 本機查詢只要微秒，不必再經過快取
+        info = local_geo(ip)
+        return {"ip": ip, "country": info["country"], "city": info["city"], "org": info["org"]}
+    cached = geo_cached(ip)
+    if cached is None:
+        info = fetch_geo_from_provider(ip)
+        if info.get("provider") == "cooldown":
+            # 限流是整個 provider 的狀態，不是這個 IP 查不到；不快取，冷卻結束後再查
+            return {"ip": ip, "country": "", "city": "", "org": ""}
+        cached = {k: info.get(k, "") for k in ("country", "city", "org")}
+        cached["ts"] = int(time.time())
+        cached["ok"] = info.get("provider") not in ("error", "off")
+        GEO_CACHE[ip] = cached
+        save_geo_entries({ip: cached})
+    return {"ip": ip, "country": cached.get("country", ""), "city": cached.get("city", ""),
+            "org": cached.get("org", "")}
+
+GEO_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("GEO_WORKERS", "16")), thread_name_prefix="geo")
+_GEO_INFLIGHT = {}  # { ip: Future }：查詢中的 IP，重疊的請求共用同一次外連
+_GEO_INFLIGHT_LOCK = threading.Lock()
+
+def submit_geo_lookup(ip: str):
+    with _GEO_INFLIGHT_LOCK:
+        fut = _GEO_INFLIGHT.get(ip)
+        if fut is None:
+            fut = GEO_POOL.submit(geo_lookup, ip)
+            _GEO_INFLIGHT[ip] = fut
+            fut.add_done_callback(lambda _f, ip=ip: _GEO_INFLIGHT.pop(ip, None))
+    return fut
 
 # --- Routes ---
 
+def _json(obj):
+    # 取代 jsonify：直接用 orjson 編碼並建 Response，少掉 Flask JSON provider 的開銷
+    return Response(orjson.dumps(obj), mimetype="application/json")
+
+# --- gzip：記錄內容重複性高，壓縮後通常只剩 1/5～1/10 ---
+GZIP_MIN_SIZE = 1024
+
+def wants_gzip() -> bool:
+    return request.accept_encodings["gzip"] > 0
+
+def cached_gzip(cache: dict, lock, key, body: bytes) -> bytes:
+    """壓縮結果存在快取項目的 "gz" 欄；同一個 key 只壓一次。"""
+    with lock:
+        if cache["key"] == key and cache["gz"] is not None:
+            return cache["gz"]
+    gz = gzip.compress(body, 6)
+    with lock:
+        if cache["key"] == key:
+            cache["gz"] = gz
+    return gz
+
+def maybe_gzip_response(body: bytes, mimetype: str, compress=None):
+    """compress：可選的無參數函式，回傳已快取的壓縮結果。"""
+    if len(body) >= GZIP_MIN_SIZE and wants_gzip():
+        gz = compress() if compress is not None else gzip.compress(body, 6)
+        resp = Response(gz, mimetype=mimetype)
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(body, mimetype=mimetype)
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+def gzip_stream(chunks):
+    """邊產生邊壓縮（gzip 格式），記憶體只放 zlib 的內部緩衝。"""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk.encode("utf-8"))
+        if out:
+            yield out
+    yield z.flush()
+
+# /logs.csv 欄位固定：啟動時依 LOG_FIELDS 組好一行的格式字串，每列只需一次 format，
+# 不必走 csv 模組逐欄判斷要不要加引號（全部欄位一律加引號，內含的 " 變成 ""）
+_CSV_ROW = ",".join(['"{}"'] * len(LOG_FIELDS)) + "\r\n"
+
+def _csv_quote(v) -> str:
+    return "" if v is None else str(v).replace('"', '""')
+
+def csv_row(row) -> str:
+    return _CSV_ROW.format(*map(_csv_quote, row))
+
 @app.route("/")
 def root():
-    return send_from_directory(APP_DIR, "index.html")
+    if INDEX_ASSET is None:
+        return send_from_directory(APP_DIR, "index.html")  # 啟動時不存在則照舊交給 Flask（404）
+    return static_response(INDEX_ASSET)
 
 @app.route("/get_ip")
 def get_ip():
     entry = log_visit(request)
-    return jsonify({"ip": entry["ip"], "ts": entry["ts"]})
+    return _json({"ip": entry["ip"], "ts": entry["ts"]})
 
 @app.route("/logs.json")
 def logs_json():
-    items = []
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    items.append(json.loads(line))
-                except Exception:
-                    pass
-    return jsonify(items[-500:])  # 只回傳最近 500 筆
+    key, _, body = recent_logs(500)  # 只回傳最近 500 筆
+    return maybe_gzip_response(body, "application/json",
+                               lambda: cached_gzip(_LOGS_CACHE, _LOGS_CACHE_LOCK, key, body))
+
+# /logs_with_geo.json 快取：沒有待查 IP 時，結果只取決於 ring 內容，以 /logs.json 的快取 key 為準
+_GEO_LOGS_CACHE = {"key": None, "body": b"[]", "gz": None}
+_GEO_LOGS_CACHE_LOCK = threading.Lock()
+
+@app.route("/logs_with_geo.json")
+def logs_with_geo_json():
+    # 伺服器端一次把未快取的 IP 並行查完，瀏覽器只需打一支 API
+    key, items, _ = recent_logs(500)
+    uniq = dict.fromkeys(it.get("ip", "") for it in items)
+    # 內網/本機 IP 不進快取，先濾掉，免得每輪都查 SQLite、丟進 GEO_POOL
+    public = [ip for ip in uniq if ip and not is_private(ip)]
+    missing = [] if GEO_DB is not None else [ip for ip in public if geo_cached(ip) is None]
+    compress = lambda: cached_gzip(_GEO_LOGS_CACHE, _GEO_LOGS_CACHE_LOCK, key, body)
+    if not missing:
+        with _GEO_LOGS_CACHE_LOCK:
+            body = _GEO_LOGS_CACHE["body"] if _GEO_LOGS_CACHE["key"] == key else None
+        if body is not None:
+            return maybe_gzip_response(body, "application/json", compress)
+    futures = {ip: submit_geo_lookup(ip) for ip in missing}
+    geos = {ip: fut.result() for ip, fut in futures.items()}
+    geos.update((ip, geo_lookup(ip)) for ip in uniq if ip not in geos)
+    out = []
+    for it in items:
+        g = geos.get(it.get("ip", ""), {})
+        out.append({**it, "geo": {k: g.get(k, "") for k in ("country", "city", "org")}})
+    body = orjson.dumps(out)
+    if missing:
+        # 這輪有外連查詢（可能遇到冷卻而回空），不快取
+        return maybe_gzip_response(body, "application/json")
+    with _GEO_LOGS_CACHE_LOCK:
+        _GEO_LOGS_CACHE.update(key=key, body=body, gz=None)
+    return maybe_gzip_response(body, "application/json", compress)
 
 @app.route("/logs.csv")
 def logs_csv():
@@ -114,37 +476,29 @@ def logs_csv():
         n = max(1, min(int(request.args.get("n", "500")), 5000))
     except Exception:
         n = 500
-    rows = []
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    rows.append(json.loads(line))
-                except Exception:
-                    pass
-    rows = rows[-n:]
-
-    sio = io.StringIO()
-    w = csv.writer(sio)
-    w.writerow(["ts", "ip", "method", "path", "origin", "referer", "ua"])
-    for r in rows:
-        w.writerow([r.get("ts",""), r.get("ip",""), r.get("method",""), r.get("path",""),
-                    r.get("origin",""), r.get("referer",""), r.get("ua","")])
-    out = sio.getvalue()
-    return Response(out, mimetype="text/csv",
-                    headers={"Content-Disposition": f'attachment; filename="logs_last_{len(rows)}.csv"'})
+    _, cols = ring_columns(n)
+    total = len(cols[0])
+
+    def gen():
+        yield csv_row(LOG_FIELDS)
+        for row in zip(*cols):
+            yield csv_row(row)
+
+    headers = {"Content-Disposition": f'attachment; filename="logs_last_{total}.csv"', "Vary": "Accept-Encoding"}
+    if wants_gzip():
+        headers["Content-Encoding"] = "gzip"
+        return Response(stream_with_context(gzip_stream(gen())), mimetype="text/csv", headers=headers)
+    return Response(stream_with_context(gen()), mimetype="text/csv", headers=headers)
 
 @app.route("/geo")
 def geo():
     ip = (request.args.get("ip") or "").strip()
     if not ip:
-        return jsonify({"error":"missing ip"}), 400
-    return jsonify(geo_lookup(ip))
+        return _json({"error":"missing ip"}), 400
+    return _json(geo_lookup(ip))
 
-@app.route("/logs")
-def logs_page():
-    # 單檔 HTML，含 GeoIP 欄與 CSV 匯出
-    html = """
+# 單檔 HTML，含 GeoIP 欄與 CSV 匯出
+LOGS_HTML = """
 <!DOCTYPE html>
 <html lang="zh-Hant"><meta charset="utf-8">
 <title>訪客 IP 記錄</title>
@@ -162,7 +516,7 @@ code{color:#9ad1ff}
 <h1>訪客 IP 記錄 <span class="badge" id="count">最近 0 筆</span></h1>
 <div class="topbar">
   <a class="btn" id="csv" href="/logs.csv?n=500">Export CSV</a>
-  <span class="small">資料每 3 秒自動更新；GeoIP 由 ipapi.co 提供並做快取。</span>
+  <span class="small">資料每 3 秒自動更新；__GEOIP_NOTE__</span>
 </div>
 
 <table id="tbl">
@@ -176,32 +530,17 @@ code{color:#9ad1ff}
 <script>
 const tb = document.querySelector('#tbl tbody');
 const count = document.getElementById('count');
-const inMemoryGeo = {}; // 本頁快取，避免重複查詢
 
 function esc(s){ return String(s||'').replace(/[&<>"']/g, m=>({ '&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[m])); }
 
-async function fetchGeo(ip){
-  if (!ip || inMemoryGeo[ip]) return inMemoryGeo[ip] || {country:"",city:"",org:""};
-  try {
-    const res = await fetch('/geo?ip='+encodeURIComponent(ip), {cache:'no-store'});
-    const g = await res.json();
-    inMemoryGeo[ip] = { country: g.country||"", city: g.city||"", org: g.org||"" };
-  } catch(e){ inMemoryGeo[ip] = {country:"", city:"", org:""}; }
-  return inMemoryGeo[ip];
-}
-
 async function loadLogs(){
-  const res = await fetch('/logs.json', {cache:'no-store'});
+  const res = await fetch('/logs_with_geo.json', {cache:'no-store'});
   const items = await res.json();
   count.textContent = "最近 " + items.length + " 筆";
   tb.innerHTML = "";
 
-  // 先收集需要查詢的唯一 IP
-  const uniq = [...new Set(items.map(x => x.ip))];
-  await Promise.all(uniq.map(ip => fetchGeo(ip)));
-
   items.forEach((it, i)=>{
-    const g = inMemoryGeo[it.ip] || {};
+    const g = it.geo || {};
     const geo = [g.country, g.city, g.org].filter(Boolean).join(" · ");
     const tr = document.createElement('tr');
     tr.innerHTML = `<td>${i+1}</td>
@@ -216,22 +555,51 @@ async function loadLogs(){
     tb.appendChild(tr);
   });
 }
-loadLogs();
-setInterval(loadLogs, 3000);
+// 上一輪結束後才排下一輪，避免查詢較慢時請求重疊
+async function poll(){
+  try { await loadLogs(); } catch(e){}
+  setTimeout(poll, 3000);
+}
+poll();
 </script>
 """
-    return Response(html, mimetype="text/html")
+
+# 靜態頁面啟動時讀進記憶體並算好 ETag，之後不再碰檔案系統
+def _static_asset(body: bytes, mimetype: str = "text/html") -> dict:
+    return {"body": body, "etag": hashlib.md5(body).hexdigest(), "mimetype": mimetype}
+
+def _load_static(path: str):
+    try:
+        with open(path, "rb") as f:
+            return _static_asset(f.read())
+    except OSError:
+        return None
+
+INDEX_ASSET = _load_static(os.path.join(APP_DIR, "index.html"))
+SIMULATOR_ASSET = _load_static(SIMULATOR_PATH) if SIMULATOR_EXISTS else None
+SIMULATOR_MISSING_HTML = "<h1>Simulator not found</h1><p>把攻擊模擬器 HTML 放在專案根目錄後再訪問 /simulator。</p>".encode("utf-8")
+GEOIP_NOTE = "GeoIP 由本機 GeoLite2 資料庫提供。" if GEO_DB is not None else "GeoIP 由 ipapi.co 提供並做快取。"
+LOGS_ASSET = _static_asset(LOGS_HTML.replace("__GEOIP_NOTE__", GEOIP_NOTE).encode("utf-8"))
+
+def static_response(asset: dict):
+    resp = Response(asset["body"], mimetype=asset["mimetype"])
+    resp.set_etag(asset["etag"])
+    resp.headers["Cache-Control"] = "public, max-age=60"
+    return resp.make_conditional(request)  # If-None-Match 相符時回 304
+
+@app.route("/logs")
+def logs_page():
+    return static_response(LOGS_ASSET)
 
 @app.route("/simulator")
 def simulator():
-    name = "attack_simulator_integrated_full.html"
-    if os.path.exists(os.path.join(APP_DIR, name)):
-        return send_from_directory(APP_DIR, name)
-    return Response("<h1>Simulator not found</h1><p>把攻擊模擬器 HTML 放在專案根目錄後再訪問 /simulator。</p>", mimetype="text/html")
+    if SIMULATOR_ASSET is not None:
+        return static_response(SIMULATOR_ASSET)
+    return Response(SIMULATOR_MISSING_HTML, mimetype="text/html")
 
 @app.route("/health")
 def health():
-    return jsonify({"ok": True})
+    return _json({"ok": True})
 
 if __name__ == "__main__":
     # 本機或 Replit 開發